@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Summary:
+Guard the start-up time of the analysis modules. Each module is imported in a fresh
+interpreter (best of `--repeat` runs) and checked against a time budget and a list of
+heavy dependencies that need to be deferred to first use.
+
+Usage:
+python benchmark_import.py [--repeat 5] [--factor 1.]
+
+Exits with status 1 if any module is over budget or imports a deferred dependency.
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+# module: (budget in seconds, dependencies which must not be imported)
+budgets = {
+    'healpix_functions': (.5, ['xarray', 'healpy', 'scipy', 'matplotlib', 'cartopy', 'pandas', 'easygems']),
+    'etccdi_dict': (.1, ['pandas']),
+    'utils': (.5, ['xarray', 'healpy', 'matplotlib', 'cartopy', 'pandas', 'easygems']),
+}
+
+template = """
+import sys, time, json
+t0 = time.perf_counter()
+import {module}
+dt = time.perf_counter() - t0
+print(json.dumps({{'time': dt, 'modules': sorted({{m.split('.')[0] for m in sys.modules}})}}))
+"""
+
+
+def measure(module: str, repeat: int) -> tuple:
+    times = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, '-c', template.format(module=module)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(out.splitlines()[-1])
+        times.append(result['time'])
+    return min(times), result['modules']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--factor', type=float, default=1., help='Scale all time budgets (e.g., for slow file systems)')
+    args = parser.parse_args()
+
+    failed = False
+    for module, (budget, forbidden) in budgets.items():
+        time, modules = measure(module, args.repeat)
+        budget *= args.factor
+        loaded = sorted(set(forbidden) & set(modules))
+        ok = time <= budget and not loaded
+        failed |= not ok
+        print('{:<20} {:6.3f}s (budget {:.3f}s) {}{}'.format(
+            module, time, budget, 'ok' if ok else 'FAILED',
+            f' imports {", ".join(loaded)}' if loaded else ''))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
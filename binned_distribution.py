@@ -0,0 +1,153 @@
+import os
+import pickle
+
+import numpy as np
+
+
+class BinnedDistribution:
+    """Cumulative distributions of binned frequencies on several zoom levels.
+
+    The cumulative sums from below (non-exceedance) and from above (exceedance, precise
+    also far in the tail) are computed once per zoom level. Queries at arbitrary
+    thresholds and quantiles then only need to locate one bin: in constant time for
+    equidistant bins, otherwise with a binary search. Values are assumed to be uniformly
+    distributed within each bin.
+
+    Parameters
+    ----------
+    frequencies : dict {zoom: np.ndarray, shape (B,)}
+        Relative frequencies per bin, e.g., the binned pickles of `00_binning.ipynb`.
+    bounds : np.ndarray, shape (B + 1,)
+        Bin bounds (same convention as `np.histogram`).
+
+    Examples
+    --------
+    >>> dist = BinnedDistribution.from_file('pr_binned-frequencies_icon_2021-2049.pkl', bounds_all)
+    >>> dist.non_exceedance(1, zoom=9)  # dry day frequency for a 1 mm/day threshold
+    >>> dist.quantile(.99, zoom=6)
+    """
+    def __init__(self, frequencies: dict, bounds):
+        self.bounds = np.asarray(bounds, dtype=np.float64)
+        self.frequencies = {}
+        self.cdf = {}
+        self.sf = {}
+        for zoom, freq in frequencies.items():
+            freq = np.asarray(freq, dtype=np.float64)
+            if freq.size != self.bounds.size - 1:
+                raise ValueError(f'{zoom=}: {freq.size} bins but {self.bounds.size} bounds')
+            self.frequencies[zoom] = freq
+            # cdf[i] = freq[:i].sum(), sf[i] = freq[i:].sum()
+            self.cdf[zoom] = np.concatenate([[0], np.cumsum(freq)])
+            self.sf[zoom] = np.concatenate([np.cumsum(freq[::-1])[::-1], [0]])
+
+        self._source = None
+        self._init_bins()
+
+    def __repr__(self):
+        return f'{type(self).__name__}(zooms={self.zooms}, bins={self.bounds.size - 1})'
+
+    @property
+    def zooms(self):
+        return sorted(self.frequencies)
+
+    @classmethod
+    def from_file(cls, fn, bounds, cache=False):
+        """Load binned frequencies from a pickle and compute their cumulative distributions.
+
+        Parameters
+        ----------
+        fn : string
+            Pickle with a dict {zoom: np.ndarray} as written by `00_binning.ipynb`.
+        bounds : np.ndarray
+        cache : bool or string, optional, by default False
+            Store the cumulative distributions in a .npz file and read them from there on
+            later calls. True uses the name of the pickle with the extension `.cdf.npz`, a
+            string is used as path. The cache is rebuilt if the modification time or size
+            of the pickle or the `bounds` differ from the ones it was built from.
+        """
+        bounds = np.asarray(bounds, dtype=np.float64)
+        stat = os.stat(fn)
+        source = np.array([stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+
+        fn_cdf = None
+        if cache:
+            fn_cdf = cache if isinstance(cache, str) else f'{os.path.splitext(fn)[0]}.cdf.npz'
+        if fn_cdf is not None and os.path.isfile(fn_cdf):
+            dist = cls.load(fn_cdf)
+            if (dist._source is not None and np.array_equal(dist._source, source)
+                    and np.array_equal(dist.bounds, bounds)):
+                return dist
+
+        with open(fn, 'rb') as ff:
+            dist = cls(pickle.load(ff), bounds)
+        dist._source = source
+        if fn_cdf is not None:
+            dist.save(fn_cdf)
+        return dist
+
+    def save(self, fn):
+        """Store frequencies and cumulative distributions of all zoom levels in one .npz file."""
+        arrays = {'bounds': self.bounds}
+        if self._source is not None:  # modification time and size of the pickle
+            arrays['source'] = self._source
+        for zoom in self.zooms:
+            arrays[f'frequencies_{zoom}'] = self.frequencies[zoom]
+            arrays[f'cdf_{zoom}'] = self.cdf[zoom]
+            arrays[f'sf_{zoom}'] = self.sf[zoom]
+        np.savez(fn, **arrays)
+
+    @classmethod
+    def load(cls, fn):
+        """Load a file written by `save` without recomputing the cumulative sums."""
+        with np.load(fn) as data:
+            dist = cls.__new__(cls)
+            dist.bounds = data['bounds']
+            zooms = [int(key.split('_')[1]) for key in data.files if key.startswith('frequencies_')]
+            dist.frequencies = {zoom: data[f'frequencies_{zoom}'] for zoom in zooms}
+            dist.cdf = {zoom: data[f'cdf_{zoom}'] for zoom in zooms}
+            dist.sf = {zoom: data[f'sf_{zoom}'] for zoom in zooms}
+            dist._source = data['source'] if 'source' in data.files else None
+        dist._init_bins()
+        return dist
+
+    def _init_bins(self):
+        # leading equidistant bins can be located without a search
+        steps = np.diff(self.bounds)
+        self._step = steps[0]
+        irregular = np.where(~np.isclose(steps, self._step, rtol=1e-6, atol=0))[0]
+        self._nuniform = irregular[0] if irregular.size > 0 else steps.size
+
+    def _locate(self, threshold):
+        """Bin index i with bounds[i] <= threshold < bounds[i + 1] and position within the bin."""
+        threshold = np.clip(np.asarray(threshold, dtype=np.float64), self.bounds[0], self.bounds[-1])
+        pos = (threshold - self.bounds[0]) / self._step
+        # snap to bin edges within rounding (e.g., 0.1 / 0.01 = 9.999999999999998)
+        pos = np.where(np.isclose(pos, np.rint(pos), rtol=0, atol=1e-9), np.rint(pos), pos)
+        idx = np.floor(pos).astype(int)
+        uniform = idx < self._nuniform
+        if not np.all(uniform):
+            idx = np.where(uniform, idx, np.searchsorted(self.bounds, threshold, side='right') - 1)
+        idx = np.minimum(idx, self.bounds.size - 2)
+        lower, upper = self.bounds[idx], self.bounds[idx + 1]
+        frac = np.where(uniform, pos - idx, (threshold - lower) / (upper - lower))
+        return idx, np.clip(frac, 0, 1)
+
+    def non_exceedance(self, threshold, zoom):
+        """Frequency of values < `threshold`, e.g., dry days."""
+        idx, frac = self._locate(threshold)
+        return self.cdf[zoom][idx] + frac * self.frequencies[zoom][idx]
+
+    def exceedance(self, threshold, zoom):
+        """Frequency of values >= `threshold`."""
+        idx, frac = self._locate(threshold)
+        return self.sf[zoom][idx] - frac * self.frequencies[zoom][idx]
+
+    def quantile(self, q, zoom):
+        """Value below which a fraction `q` of the values lies (inverse of `non_exceedance`)."""
+        cdf = self.cdf[zoom]
+        q = np.asarray(q, dtype=np.float64)
+        idx = np.clip(np.searchsorted(cdf, q, side='right') - 1, 0, self.bounds.size - 2)
+        freq = self.frequencies[zoom][idx]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            frac = np.clip(np.where(freq > 0, (q - cdf[idx]) / freq, 1), 0, 1)
+        return self.bounds[idx] + frac * (self.bounds[idx + 1] - self.bounds[idx])
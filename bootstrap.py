@@ -0,0 +1,122 @@
+import numpy as np
+
+from healpix_functions import aggregate_grid, evaluate_against_coarse, npix2nside, _guess_gridn, _load_block
+
+
+def bootstrap_weights(nyears: int, nsamples: int=1000, seed=None) -> np.ndarray:
+    """Draw years with replacement, represented as how often each year is drawn.
+
+    Parameters
+    ----------
+    nyears : int
+    nsamples : int, optional, by default 1000
+    seed : int, optional, by default None
+        Seed of `np.random.default_rng`. Use the same seed for all fields that are
+        compared to each other so they are resampled consistently.
+
+    Returns
+    -------
+    np.ndarray, shape (nsamples, nyears)
+        Integer weights summing to `nyears` for each sample.
+    """
+    rng = np.random.default_rng(seed)
+    return rng.multinomial(nyears, np.full(nyears, 1 / nyears), size=nsamples)
+
+
+def bootstrap_mean(arr, weights: np.ndarray, block_size: int=2**16) -> np.ndarray:
+    """Bootstrap samples of the time mean as matrix product of the weights and the data.
+
+    Parameters
+    ----------
+    arr : np.ndarray or xr.DataArray, shape (Y, M)
+        Read block by block if lazily indexed (see `healpix_functions.map_blocks`).
+    weights : np.ndarray, shape (S, Y)
+        See `bootstrap_weights`.
+    block_size : int, optional, by default 2**16
+        Number of cells loaded at once.
+
+    Returns
+    -------
+    np.ndarray, shape (S, M)
+    """
+    weights = np.asarray(weights, dtype=np.float64) / np.sum(weights[0])
+    npix = arr.shape[-1]
+    result = np.empty((weights.shape[0], npix), dtype=np.float32)
+    for start in range(0, npix, block_size):
+        block = _load_block(arr, start, start + block_size)
+        np.matmul(weights, block.astype(np.float64), out=result[:, start:start + block.shape[-1]], casting='same_kind')
+    return result
+
+
+def bootstrap_anomaly(fine, coarse=None, z_coarse=None, nsamples: int=1000, confidence: float=.9, seed=None, block_size: int=2**16) -> dict:
+    """Bootstrap confidence intervals of the time mean sub-grid anomaly, block by block.
+
+    For each block of cells the anomaly (see `evaluate_against_coarse` and `sub_grid_anomaly`)
+    is computed once and all bootstrap means are computed from it as one matrix product.
+    Only one block of anomalies and bootstrap samples is held in memory at a time.
+
+    Parameters
+    ----------
+    fine : np.ndarray or xr.DataArray, shape (Y, M)
+        Read block by block if lazily indexed (see `healpix_functions.map_blocks`).
+    coarse : np.ndarray or xr.DataArray, shape (Y, N<M), optional, by default None
+        Values on the coarse grid (regrid first). Exactly one of `coarse` and `z_coarse`
+        needs to be given.
+    z_coarse : int, optional, by default None
+        Aggregate `fine` to this zoom level to get the coarse values (index first).
+    nsamples : int, optional, by default 1000
+    confidence : float, optional, by default .9
+        Width of the central confidence interval.
+    seed : int, optional, by default None
+        See `bootstrap_weights`.
+    block_size : int, optional, by default 2**16
+        Number of fine cells loaded at once. Rounded to a multiple of the sub-grid cells.
+
+    Returns
+    -------
+    dict {name: np.ndarray, shape (M,)}
+        'mean', 'lower', 'upper' and 'significant' (interval does not contain zero).
+    """
+    if (coarse is None) == (z_coarse is None):
+        raise ValueError('Exactly one of `coarse` and `z_coarse` needs to be given')
+    nyears, npix = fine.shape
+    if coarse is not None:
+        ratio = npix // coarse.shape[-1]
+    else:
+        z_fine = int(np.log2(npix2nside(npix)))
+        ratio = 4**(z_fine - z_coarse)
+    block_size = max(block_size // ratio, 1) * ratio
+
+    weights = bootstrap_weights(nyears, nsamples, seed).astype(np.float64) / nyears
+    quantiles = [(1 - confidence) / 2, (1 + confidence) / 2]
+    result = {key: np.empty(npix, dtype=np.float32) for key in ['mean', 'lower', 'upper']}
+
+    for start in range(0, npix, block_size):
+        block = _load_block(fine, start, start + block_size).astype(np.float64)
+        cells = slice(start, start + block.shape[-1])
+        if coarse is not None:
+            block_coarse = _load_block(coarse, start // ratio, cells.stop // ratio)
+        else:  # a contiguous nested block maps onto a contiguous coarse block
+            block_coarse = aggregate_grid(block, z_coarse, 'mean', z_in=z_fine)
+        anomaly = evaluate_against_coarse(block, block_coarse, out=block)
+        result['mean'][cells] = anomaly.mean(axis=0)
+        # samples as (cells, S): quantiles along the contiguous axis are faster
+        samples = anomaly.T @ weights.T
+        result['lower'][cells], result['upper'][cells] = np.quantile(samples, quantiles, axis=-1)
+
+    result['significant'] = (result['lower'] > 0) | (result['upper'] < 0)
+    return result
+
+
+def bootstrap_anomaly_xarray(da_fine, da_coarse=None, z_coarse=None, gridn=None, **kwargs):
+    """xarray wrapper for `bootstrap_anomaly` returning an xr.Dataset."""
+    import xarray as xr
+
+    if gridn is None:  # try to guess grid name from frequent options
+        gridn = _guess_gridn(da_fine)
+
+    da_fine = da_fine.transpose(..., gridn)
+    if da_coarse is not None:
+        da_coarse = da_coarse.transpose(..., _guess_gridn(da_coarse))
+    result = bootstrap_anomaly(da_fine, da_coarse, z_coarse, **kwargs)
+    return xr.Dataset({key: (gridn, value) for key, value in result.items()})
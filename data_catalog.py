@@ -0,0 +1,146 @@
+import os
+from collections import OrderedDict
+
+from etccdi_dict import etccdi_indices
+from instrument import stage
+from healpix_functions import _guess_gridn
+
+
+models = {
+    'icon': 'ICON-ngc4008',
+    'ifs': 'IFS-9-FESOM-5-production',
+}
+base_variables = ['tasmax', 'tasmin', 'tas', 'pr']
+
+
+class IndexCatalog:
+    """Lazy access to the nextGEMS ETCCDI index files by (index, model, zoom).
+
+    Files are expected at `{path}/{model}/z{zoom}/{index}_{frequency}_{model}_{scenario}_zoom{zoom}.nc`.
+    Datasets are only opened on first access and at most `max_open` of them are
+    kept open at the same time (least recently used ones are closed first).
+    Closing a dataset does not invalidate DataArrays returned earlier: xarray
+    re-opens the file when their data is accessed.
+
+    Parameters
+    ----------
+    path : string, optional, by default 'data'
+    scenario : string, optional, by default 'ssp370'
+    max_open : int, optional, by default 16
+        Maximum number of simultaneously open datasets.
+    chunks : dict, optional, by default {}
+        Passed on to `xr.open_dataset`. The default uses the chunking of the files.
+        The grid dimension is always merged into a single chunk as required by
+        the functions in `healpix_functions` (see `get` for block-wise processing).
+    dtype : np.dtype, optional, by default None
+        Default floating point type of the returned DataArrays (e.g., np.float32).
+        By default the type after decoding the file is kept.
+
+    Examples
+    --------
+    >>> catalog = IndexCatalog()
+    >>> txx_z9 = catalog['txx', 'icon', 9]
+    >>> txx_z6 = catalog.get('txx', 'IFS-9-FESOM-5-production', 6, time=slice('2030', '2039'))
+    """
+    def __init__(self, path='data', scenario='ssp370', max_open=16, chunks=None, dtype=None):
+        if max_open < 1:
+            raise ValueError(f'{max_open=}')
+        self.path = path
+        self.scenario = scenario
+        self.max_open = max_open
+        self.chunks = {} if chunks is None else chunks
+        self.dtype = dtype
+        self._open = OrderedDict()
+
+    def __repr__(self):
+        return f'{type(self).__name__}(path={self.path!r}, scenario={self.scenario!r}, open={len(self._open)}/{self.max_open})'
+
+    def __getitem__(self, key):
+        return self.get(*key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def filename(self, index, model, zoom, frequency='ann'):
+        """Return the path of the file containing `index` for `model` at `zoom`."""
+        if index not in etccdi_indices and index not in base_variables:
+            raise KeyError(f'{index=} is neither an ETCCDI index nor a base variable')
+        model = models.get(model, model)
+        return os.path.join(
+            self.path, model, f'z{zoom}',
+            f'{index}_{frequency}_{model}_{self.scenario}_zoom{zoom}.nc')
+
+    def open_dataset(self, index, model, zoom, frequency='ann', lazy=False):
+        """Return the (lazily opened) xr.Dataset, re-using open file handles.
+
+        `lazy` opens the file without dask (see `get`).
+        """
+        fn = self.filename(index, model, zoom, frequency)
+        key = (fn, lazy)
+        if key in self._open:
+            self._open.move_to_end(key)
+            return self._open[key]
+
+        import xarray as xr
+
+        with stage('open_dataset', file=fn, file_bytes=os.path.getsize(fn)):
+            if lazy:
+                ds = xr.open_dataset(fn, decode_timedelta=False, chunks=None, cache=False)
+            else:
+                ds = xr.open_dataset(fn, decode_timedelta=False, chunks=self.chunks)
+        self._open[key] = ds
+        while len(self._open) > self.max_open:
+            _, ds_old = self._open.popitem(last=False)
+            ds_old.close()
+        return ds
+
+    def get(self, index, model, zoom, time=None, frequency='ann', dtype=None, lazy=False):
+        """Return `index` as dask-backed xr.DataArray without grid information.
+
+        Parameters
+        ----------
+        index : string
+            Key of `etccdi_indices` or one of `base_variables`.
+        model : string
+            Full model name or short name (key of `models`).
+        zoom : int
+        time : slice or string, optional, by default None
+            Passed on to `.sel(time=time)`.
+        frequency : string, optional, by default 'ann'
+        dtype : np.dtype, optional, by default None
+            Overwrites the default type of the catalog for this DataArray.
+            Not applied if `lazy` (converting would load the data).
+        lazy : bool, optional, by default False
+            Return the lazily indexed variable without dask instead. Indexing it only
+            reads the selected part of the file, whereas each block of the dask-backed
+            DataArray computes the full grid chunk. Use this for block-wise processing
+            (e.g., `healpix_functions.map_blocks` or `etccdi_compute.compute_indices`
+            with `block_size`).
+
+        Returns
+        -------
+        xr.DataArray
+        """
+        da = self.open_dataset(index, model, zoom, frequency, lazy)[index]
+        # keeping these breaks xarrays apply_ufunc
+        da = da.drop_vars(['lon', 'lat', 'crs'], errors='ignore')
+        if not lazy:
+            da = da.chunk({_guess_gridn(da): -1})
+        if time is not None:
+            da = da.sel(time=time)
+        if lazy:
+            return da
+        if dtype is None:
+            dtype = self.dtype
+        if dtype is not None:
+            da = da.astype(dtype)
+        return da
+
+    def close(self):
+        """Close all open datasets."""
+        while self._open:
+            _, ds = self._open.popitem(last=False)
+            ds.close()
@@ -0,0 +1,254 @@
+import numpy as np
+
+from etccdi_dict import etccdi_registry
+from healpix_functions import aggregate_grid, npix2nside, _guess_gridn
+
+
+# How to compute each index from daily data of its base variable (see `etccdi_indices`):
+# acronym: (statistic, threshold, comparison)
+# Absolute thresholds are in degC and mm/day, string thresholds refer to the percentile
+# based thresholds in `etccdi_definitions` which need to be passed to `compute_indices`.
+index_specs = {
+    # counts of days
+    'su': ('count', 25, '>'),
+    'id': ('count', 0, '<'),
+    'fd': ('count', 0, '<'),
+    'tr': ('count', 20, '>'),
+    'r10mm': ('count', 10, '>='),
+    'r20mm': ('count', 20, '>='),
+    # extremes
+    'txx': ('max', None, None),
+    'txn': ('min', None, None),
+    'tnx': ('max', None, None),
+    'tnn': ('min', None, None),
+    'rx1day': ('max', None, None),
+    'rx5day': ('max5', None, None),
+    # spells
+    'cwd': ('spell_max', 1, '>='),
+    'cdd': ('spell_max', 1, '<'),
+    'wsdi': ('spell_days', 'tx90p_thr', '>'),
+    'csdi': ('spell_days', 'tn10p_thr', '<'),
+    # totals and fractions
+    'prcptot': ('sum', 1, '>='),
+    'sdii': ('mean', 1, '>='),
+    'r95p': ('sum', 'r95_thr', '>'),
+    'r99p': ('sum', 'r99_thr', '>'),
+    'tx90p': ('fraction', 'tx90p_thr', '>'),
+    'tx10p': ('fraction', 'tx10p_thr', '<'),
+    'tn90p': ('fraction', 'tn90p_thr', '>'),
+    'tn10p': ('fraction', 'tn10p_thr', '<'),
+}
+
+spell_length = 6  # minimum length of warm/cold spells (wsdi, csdi)
+
+# units of the output: statistics returning days, fractions (same as `etccdi_indices`) or
+# annual totals (only of precipitation), others the standard units
+statistic_units = {
+    'count': 'day',
+    'spell_max': 'day',
+    'spell_days': 'day',
+    'fraction': '1',
+    'sum': 'mm',
+}
+standard_units = {'tasmax': 'degC', 'tasmin': 'degC', 'tas': 'degC', 'pr': 'mm/day'}
+
+# factor, offset to convert the base variables to degC and mm/day
+unit_conversions = {
+    'degC': (1, 0),
+    'K': (1, -273.15),
+    'mm/day': (1, 0),
+    'mm': (1, 0),
+    'kg m-2 s-1': (86400, 0),
+    'm': (1000, 0),
+}
+
+_comparisons = {
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '<': np.less,
+    '<=': np.less_equal,
+}
+
+
+def _condition(daily: np.ndarray, index: str, threshold) -> np.ndarray:
+    _, default, comparison = index_specs[index]
+    if threshold is None:
+        if isinstance(default, str):
+            raise ValueError(f'{index=} needs the percentile threshold {default!r}')
+        threshold = default
+    return _comparisons[comparison](daily, threshold)
+
+
+def _spells(condition: np.ndarray, min_length: int=1):
+    """Maximum spell length and number of days in spells of at least `min_length` days."""
+    run = np.zeros(condition.shape[1:], dtype=np.int32)
+    longest = np.zeros_like(run)
+    days = np.zeros_like(run)
+    for cond in condition:  # loop over time, vectorized over cells
+        run += 1
+        run *= cond
+        np.maximum(longest, run, out=longest)
+        days += (run == min_length) * min_length + (run > min_length)
+    return longest, days
+
+
+def annual_index(daily: np.ndarray, index: str, threshold=None) -> np.ndarray:
+    """Compute one ETCCDI index from one year of daily data.
+
+    Parameters
+    ----------
+    daily : np.ndarray, shape (T, M)
+        Daily values of the base variable in degC or mm/day.
+    index : string
+        Key of `index_specs`
+    threshold : float or np.ndarray, optional, by default None
+        Overwrites the default absolute threshold. Required for percentile based indices:
+        shape (M,) (e.g., 'r95_thr') or (T, M) (day-of-year thresholds, e.g., 'tx90p_thr').
+
+    Returns
+    -------
+    np.ndarray, shape (M,)
+    """
+    statistic = index_specs[index][0]
+
+    if statistic == 'max':
+        return daily.max(axis=0)
+    if statistic == 'min':
+        return daily.min(axis=0)
+    if statistic == 'max5':
+        # 5-day running sums within the year, accumulated in float64
+        cumsum = np.cumsum(daily, axis=0, dtype=np.float64)
+        cumsum = np.concatenate([np.zeros((1,) + daily.shape[1:]), cumsum])
+        return (cumsum[5:] - cumsum[:-5]).max(axis=0).astype(daily.dtype)
+
+    condition = _condition(daily, index, threshold)
+    if statistic == 'count':
+        return condition.sum(axis=0).astype(daily.dtype)
+    if statistic == 'fraction':
+        return condition.mean(axis=0).astype(daily.dtype)
+    if statistic == 'spell_max':
+        return _spells(condition)[0].astype(daily.dtype)
+    if statistic == 'spell_days':
+        return _spells(condition, spell_length)[1].astype(daily.dtype)
+    if statistic == 'sum':
+        return np.where(condition, daily, 0).sum(axis=0, dtype=np.float64).astype(daily.dtype)
+    if statistic == 'mean':
+        total = np.where(condition, daily, 0).sum(axis=0, dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (total / condition.sum(axis=0)).astype(daily.dtype)
+
+    raise ValueError(f'{statistic=}')
+
+
+def _select_threshold(thresholds, index, zoom, dayofyear, cells):
+    """Threshold of a percentile based index for the current year and block of cells."""
+    name = index_specs[index][1]
+    if not isinstance(name, str):
+        return None
+    try:
+        threshold = thresholds[zoom][name]
+    except (KeyError, TypeError):
+        raise ValueError(f'{index=} needs thresholds[{zoom}][{name!r}]')
+    threshold = np.asarray(threshold)
+    if threshold.ndim == 1:
+        return threshold[cells]
+    return threshold[dayofyear - 1][:, cells]
+
+
+def compute_indices(daily, indices, zooms=None, thresholds=None, units=None, block_size=None, dtype=np.float32) -> dict:
+    """Compute annual ETCCDI indices from daily healpix data, one year at a time.
+
+    Each year (and block of cells) is read only once. From it the daily field is
+    aggregated conservatively (`aggregate_grid(..., method='mean')`) to all
+    requested zoom levels and the indices are computed on each of them.
+
+    Parameters
+    ----------
+    daily : xr.DataArray, dims (time, cell)
+        Daily values of one base variable (can be lazy, e.g., from `IndexCatalog`).
+    indices : list of string
+        Keys of `index_specs`. All need to be based on the variable in `daily` and valid
+        for annual aggregation.
+    zooms : list of int, optional, by default None
+        Zoom levels to compute the indices on. Defaults to the zoom level of `daily`.
+    thresholds : dict {zoom: {name: np.ndarray}}, optional
+        Percentile based thresholds (see `etccdi_definitions`) on each zoom level. Day-of-year
+        thresholds have shape (366, N), others (N,).
+    units : string, optional, by default None
+        Units of `daily` (key of `unit_conversions`). Defaults to `daily.attrs['units']`.
+    block_size : int, optional, by default None
+        Number of cells read at once. Needs to be a multiple of the number of sub-grid cells
+        of the coarsest zoom level. By default all cells are read at once.
+    dtype : np.dtype, optional, by default np.float32
+
+    Returns
+    -------
+    dict {zoom: xr.Dataset}
+        One variable per index with dimensions (time, cell), one time step per year.
+    """
+    import xarray as xr
+
+    gridn = _guess_gridn(daily)
+    npix = daily[gridn].size
+    zoom_in = int(np.log2(npix2nside(npix)))
+    zooms = [zoom_in] if zooms is None else list(zooms)
+    if max(zooms) > zoom_in:
+        raise ValueError(f'Zoom levels need to be <= {zoom_in}')
+
+    base_variable = None
+    for index in indices:
+        if index not in index_specs:
+            raise ValueError(f'{index=} needs to be one of {", ".join(index_specs)}')
+        record = etccdi_registry[index]
+        if 'year' not in record.valid_time_aggregation:
+            raise ValueError(f'{index=} is not valid for annual aggregation')
+        if base_variable is not None and record.base_variable != base_variable:
+            raise ValueError('All indices need to be based on the same variable')
+        base_variable = record.base_variable
+
+    if units is None:
+        units = daily.attrs.get('units')
+    if units not in unit_conversions:
+        raise ValueError(f'{units=} needs to be one of {", ".join(unit_conversions)}')
+    factor, offset = unit_conversions[units]
+
+    ratio_max = 4**(zoom_in - min(zooms))
+    if block_size is None:
+        block_size = npix
+    if block_size % ratio_max != 0:
+        raise ValueError(f'block_size needs to be a multiple of {ratio_max}')
+
+    years = np.unique(daily['time'].dt.year.values)
+    results = {
+        zoom: {index: np.full((years.size, 12 * 4**zoom), np.nan, dtype=dtype) for index in indices}
+        for zoom in zooms}
+
+    for iy, year in enumerate(years):
+        daily_year = daily.isel(time=daily['time'].dt.year.values == year)
+        dayofyear = daily_year['time'].dt.dayofyear.values
+        for start in range(0, npix, block_size):
+            values = daily_year.isel({gridn: slice(start, start + block_size)}).values.astype(dtype)
+            values *= factor
+            values += offset
+            for zoom in zooms:
+                ratio = 4**(zoom_in - zoom)
+                cells = slice(start // ratio, (start + values.shape[1]) // ratio)
+                if zoom == zoom_in:
+                    values_zoom = values
+                else:  # a contiguous nested block maps onto a contiguous coarse block
+                    values_zoom = aggregate_grid(values, zoom, 'mean', z_in=zoom_in)
+                for index in indices:
+                    threshold = _select_threshold(thresholds, index, zoom, dayofyear, cells)
+                    results[zoom][index][iy, cells] = annual_index(values_zoom, index, threshold)
+
+    time = [daily['time'].values[daily['time'].dt.year.values == year][0] for year in years]
+    attrs = {index: {
+        'units': statistic_units.get(index_specs[index][0], standard_units[base_variable[0]]),
+        'long_name': etccdi_registry[index].long_name,
+    } for index in indices}
+    return {
+        zoom: xr.Dataset(
+            {index: (('time', gridn), results[zoom][index], attrs[index]) for index in indices},
+            coords={'time': time},
+        )
+        for zoom in zooms}
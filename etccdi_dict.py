@@ -7,7 +7,8 @@
 Summary:
 
 """
-import pandas as pd
+from dataclasses import dataclass, fields
+from functools import cached_property
 
 
 etccdi_indices = {
@@ -382,12 +383,156 @@ etccdi_definitions = {
 }
 
 
+@dataclass(frozen=True, slots=True)
+class EtccdiIndex:
+    """Metadata of one ETCCDI index (see `etccdi_indices`)."""
+    acronym: str
+    unit: str
+    valid_range: tuple | None
+    base_variable: tuple
+    long_name: str
+    description: str
+    valid_time_aggregation: tuple
+    threshold_based: bool
+    absolute_threshold: bool
+
+    @property
+    def threshold_type(self) -> str:
+        """One of 'absolute', 'percentile', or 'none'."""
+        if not self.threshold_based:
+            return 'none'
+        return 'absolute' if self.absolute_threshold else 'percentile'
+
+
+@dataclass(frozen=True, slots=True)
+class EtccdiDefinition:
+    """Metadata of one intermediate ETCCDI variable (see `etccdi_definitions`)."""
+    acronym: str
+    unit: str
+    valid_range: tuple | None
+    base_variable: tuple
+    derived_indices: tuple
+    long_name: str
+    description: str
+
+
+def _to_record(cls, values: dict):
+    """Convert one entry of the nested dicts into a record with hashable (tuple) fields."""
+    values = dict(values)
+    values['base_variable'] = tuple(var.strip() for var in values['base_variable'].split(','))
+    for key in ['valid_range', 'valid_time_aggregation', 'derived_indices']:
+        if values.get(key) is not None:
+            values[key] = tuple(values[key])
+    return cls(**{field.name: values[field.name] for field in fields(cls)})
+
+
+class EtccdiRegistry:
+    """Read-only registry of ETCCDI metadata records with precomputed lookup indexes.
+
+    Parameters
+    ----------
+    metadata : dict
+        Nested dict, i.e., `etccdi_indices` or `etccdi_definitions`
+    record_type : type, optional, by default EtccdiIndex
+
+    Examples
+    --------
+    >>> etccdi_registry.select(base_variable='tasmax', threshold_type='absolute', time_aggregation='year')
+    ('id', 'su')
+    >>> etccdi_registry['txx'].long_name
+    'Hottest daily maximum'
+    """
+    def __init__(self, metadata: dict, record_type=EtccdiIndex):
+        self._metadata = metadata
+        self._records = {key: _to_record(record_type, values) for key, values in metadata.items()}
+
+        self._index = {}
+        for key, record in self._records.items():
+            for name, values in [
+                ('base_variable', record.base_variable),
+                ('threshold_type', (getattr(record, 'threshold_type', None),)),
+                ('time_aggregation', getattr(record, 'valid_time_aggregation', ())),
+            ]:
+                for value in values:
+                    self._index.setdefault(name, {}).setdefault(value, []).append(key)
+        self._index = {
+            name: {value: tuple(keys) for value, keys in lookup.items()}
+            for name, lookup in self._index.items()}
+
+    def __repr__(self):
+        return f'{type(self).__name__}({", ".join(self._records)})'
+
+    def __getitem__(self, key):
+        return self._records[key]
+
+    def __contains__(self, key):
+        return key in self._records
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __len__(self):
+        return len(self._records)
+
+    def keys(self):
+        return self._records.keys()
+
+    def values(self):
+        """The records (`EtccdiIndex` or `EtccdiDefinition`) in the order of the keys."""
+        return self._records.values()
+
+    def items(self):
+        return self._records.items()
+
+    def select(self, base_variable=None, threshold_type=None, time_aggregation=None) -> tuple:
+        """Acronyms of all records matching all given criteria (in registry order).
+
+        Parameters
+        ----------
+        base_variable : string, optional
+            E.g., 'tasmax'. Indices based on several variables (e.g., 'dtr') match each of them.
+        threshold_type : string, optional
+            One of 'absolute', 'percentile', 'none'
+        time_aggregation : string, optional
+            One of 'year', 'month'
+
+        Returns
+        -------
+        tuple of string
+        """
+        selected = set(self._records)
+        for name, value in [
+            ('base_variable', base_variable),
+            ('threshold_type', threshold_type),
+            ('time_aggregation', time_aggregation),
+        ]:
+            if value is not None:
+                selected &= set(self._index.get(name, {}).get(value, ()))
+        return tuple(key for key in self._records if key in selected)
+
+    @cached_property
+    def dataframe(self):
+        """pd.DataFrame view of the metadata (one row per record). Built once, do not modify."""
+        import pandas as pd
+
+        return pd.DataFrame.from_dict(self._metadata).transpose()
+
+
+etccdi_registry = EtccdiRegistry(etccdi_indices)
+etccdi_definition_registry = EtccdiRegistry(etccdi_definitions, EtccdiDefinition)
+
+
+def _display_table(df, columns):
+    import pandas as pd
+
+    with pd.option_context('display.max_colwidth', None):
+        display(df[columns])
+
+
 def print_etccdi_table(simple_table=True, columns=None):
-    df = pd.DataFrame.from_dict(etccdi_indices).transpose()
+    df = etccdi_registry.dataframe
     if simple_table:
-        pd.set_option('display.max_colwidth', None)
-        display(df[['unit', 'base_variable', 'long_name', 'description']])
-        pd.set_option('display.max_colwidth', 50)
+        _display_table(df, ['unit', 'base_variable', 'long_name', 'description'])
     elif columns is None:
         display(df)
     else:
@@ -395,12 +540,10 @@ def print_etccdi_table(simple_table=True, columns=None):
 
 
 def print_etccdi_supplement_table(simple_table=True, columns=None):
-    df = pd.DataFrame.from_dict(etccdi_definitions).transpose()
+    df = etccdi_definition_registry.dataframe
     if simple_table:
-        pd.set_option('display.max_colwidth', None)
-        display(df[['unit', 'base_variable', 'long_name', 'description', 'derived_indices']])
-        pd.set_option('display.max_colwidth', 50)
+        _display_table(df, ['unit', 'base_variable', 'long_name', 'description', 'derived_indices'])
     elif columns is None:
         display(df)
     else:
-        display(df[columns])
\ No newline at end of file
+        display(df[columns])
@@ -1,5 +1,9 @@
+import struct
+import zlib
 import numpy as np
 import xarray as xr
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import healpy as hp
 import matplotlib as mpl
 import matplotlib.pyplot as plt
@@ -7,6 +11,7 @@ import cartopy.crs as ccrs
 import easygems.healpix as egh
 import cartopy.feature as cfeature
 from matplotlib import patches
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 
 def get_listed_colormap(levels, cmap='viridis', extend='neither', white=None, return_colors=False):
@@ -103,6 +108,132 @@ def get_diverging_colormap(levels=12, cmap_neg='Blues', cmap_pos='Reds', middle_
     return cmap
 
 
+def _hashable(value):
+    """Nested tuples of Python scalars for lists and arrays, e.g., to use levels as cache keys."""
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return tuple(_hashable(v) for v in value)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _colormap_colors(cmap, extend='neither'):
+    """Colors of a ListedColormap including the under/over colors used by `extend`."""
+    if extend == 'max':
+        return np.concatenate([cmap.colors, [cmap.get_over()]])
+    if extend == 'min':
+        return np.concatenate([[cmap.get_under()], cmap.colors])
+    if extend == 'both':
+        return np.concatenate([[cmap.get_under()], cmap.colors, [cmap.get_over()]])
+    return cmap.colors
+
+
+@lru_cache(maxsize=128)
+def _listed_colormap(levels, cmap, extend, white):
+    return get_listed_colormap(levels, cmap, extend, white)
+
+
+@lru_cache(maxsize=128)
+def _cmap_norm(levels, colors, extend):
+    return mpl.colors.from_levels_and_colors(levels, colors, extend=extend)
+
+
+def get_cmap_norm(levels, cmap='viridis', extend='neither', white=None):
+    """Return a (cmap, norm) pair mapping `levels` to discrete colors, memoized.
+
+    Identical arguments return the identical (cached) objects, so they must not be
+    modified. The pair can be passed on to `default_plot` as `cmap`.
+
+    Parameters
+    ----------
+    levels : list
+        Bounds of the color levels.
+    cmap : string or list of colors or mpl.colors.ListedColormap, optional, by default 'viridis'
+        Name of a matplotlib colormap (see `get_listed_colormap`) or colors as returned by
+        `get_listed_colormap(..., return_colors=True)` or `get_diverging_colormap`.
+    extend : string, optional, one of {'neither', 'min', 'max', 'both'}, by default 'neither'
+    white : string, optional, by default None
+        Only used if `cmap` is a string, see `get_listed_colormap`.
+
+    Returns
+    -------
+    cmap, norm : mpl.colors.ListedColormap, mpl.colors.BoundaryNorm
+    """
+    levels = _hashable(levels)
+    if isinstance(cmap, str):
+        cmap = get_listed_colormap(levels, cmap, extend, white, return_colors=True)
+    elif isinstance(cmap, mpl.colors.ListedColormap):
+        cmap = _colormap_colors(cmap, extend)
+    return _cmap_norm(levels, _hashable(cmap), extend)
+
+
+@lru_cache(maxsize=4)
+def _resample_index(nside, xlims, ylims, nx, ny, projection):
+    """Nearest-neighbour lookup from the pixels of an image to nested healpix cells.
+
+    Same logic as `egh.healpix_resample(..., method='nearest', nest=True)` but cached
+    per axes geometry, so panels with identical extent and size share the expensive
+    coordinate transformation and `ang2pix` call. Each entry holds ~5 bytes per image
+    pixel (~100 MB at 20M pixels), use `clear_resample_cache` to free them.
+
+    Returns
+    -------
+    valid : np.ndarray of bool, shape (ny, nx)
+        Image pixels on the globe.
+    pix : np.ndarray of int, shape (valid.sum(),)
+        Healpix index of each valid image pixel.
+    """
+    # NOTE: we want the center coordinate of each pixel
+    dx = (xlims[1] - xlims[0]) / nx
+    dy = (ylims[1] - ylims[0]) / ny
+    xvals = np.linspace(xlims[0] + dx / 2, xlims[1] - dx / 2, nx)
+    yvals = np.linspace(ylims[0] + dy / 2, ylims[1] - dy / 2, ny)
+    xvals2, yvals2 = np.meshgrid(xvals, yvals)
+    latlon = ccrs.PlateCarree().transform_points(
+        projection, xvals2, yvals2, np.zeros_like(xvals2))
+    valid = np.all(np.isfinite(latlon), axis=-1)
+    points = latlon[valid].T
+    pix = hp.ang2pix(nside, theta=points[0], phi=points[1], nest=True, lonlat=True)
+    if 12 * nside**2 <= np.iinfo(np.int32).max:
+        pix = pix.astype(np.int32)  # halves the memory of the cached index map
+
+    valid.setflags(write=False)
+    pix.setflags(write=False)
+    return valid, pix
+
+
+def clear_resample_cache():
+    """Free the cached index maps of `healpix_resample_nearest` (e.g., after a batch of figures)."""
+    _resample_index.cache_clear()
+
+
+def _axes_geometry(ax, npix):
+    """Hashable description of the image grid of `ax` (arguments of `_resample_index`)."""
+    _, _, nx, ny = np.array(ax.bbox.bounds, dtype=int)
+    return hp.npix2nside(npix), tuple(ax.get_xlim()), tuple(ax.get_ylim()), nx, ny, ax.projection
+
+
+def healpix_resample_nearest(data, ax):
+    """Resample healpix data to the pixel grid of `ax` using nearest neighbours.
+
+    Parameters
+    ----------
+    data : np.ndarray, shape (N,)
+        Needs to be on a nested healpix grid
+    ax : cartopy.mpl.geoaxes.GeoAxes
+
+    Returns
+    -------
+    np.ndarray, shape (ny, nx)
+        Pixels outside the globe are set to NaN.
+    """
+    data = np.asarray(data)
+    valid, pix = _resample_index(*_axes_geometry(ax, data.size))
+    im = np.full(valid.shape, np.nan, dtype=np.result_type(data.dtype, np.float32))
+    im[valid] = data[pix]
+    return im
+
+
 def default_plot(
     data, 
     cmap='viridis', 
@@ -122,6 +253,7 @@ def default_plot(
     topography_kwargs=None,
     coastline_kwargs=None,
     grid_kwargs=None,
+    resampled=None,
     **kwargs
 ):
     """
@@ -130,7 +262,8 @@ def default_plot(
     ----------
     data : np.ndarray, shape (N,)
         Needs to be on a healpix grid, i.e., N needs to be divisibel by 12 * (2**zoom)**2
-    cmap : string, optional, by default 'viridis'
+    cmap : string or list of colors or tuple (cmap, norm), optional, by default 'viridis'
+        A prebuilt (cmap, norm) pair (see `get_cmap_norm`) is used as is.
     ax : string or cartopy.ccrs, optional, by default 'Mollweide'
         Possible string values:
         - 'Mollweide'
@@ -165,6 +298,9 @@ def default_plot(
         Keyword arguments passed on to `ax.contour`
     grid_kwargs : dict, optional
         Keyword arguments apssed on to `ax.gridlines`
+    resampled : np.ndarray, shape (ny, nx), optional
+        `data` already resampled to the pixel grid of `ax` (see `plot_panels`).
+        If given, the resampling step is skipped.
     **kwargs : optional
         Keyword arguments passed on to `ax.imshow`
 
@@ -259,45 +395,36 @@ def default_plot(
             **defaults
         )
 
-    if levels is not None:
+    if isinstance(cmap, tuple) and len(cmap) == 2 and isinstance(cmap[1], mpl.colors.Normalize):
+        cmap, norm = cmap  # prebuilt pair, e.g., from `get_cmap_norm`
+        kwargs.update({
+            'norm': norm,
+        })
+    elif levels is not None:
         if isinstance(cmap, str):
-            cmap = get_listed_colormap(levels, cmap, extend)
+            cmap = _listed_colormap(_hashable(levels), cmap, extend, None)
             kwargs.update({
                 'vmin': levels[0], 
                 'vmax': levels[-1],
         })
         else: 
-            if isinstance(cmap, mpl.colors.ListedColormap):  # convert back to color list 
-                if extend == 'max':
-                    cmap = np.concatenate([cmap.colors, [cmap.get_over()]])
-                elif extend == 'min':
-                    cmap = np.concatenate([[cmap.get_under()], cmap.colors])
-                elif extend == 'both':
-                    cmap = np.concatenate([[cmap.get_under()], cmap.colors, [cmap.get_over()]])
-                else:
-                    cmap = cmap.colors
-                    
-            cmap, norm = mpl.colors.from_levels_and_colors(levels, cmap, extend=extend)
+            cmap, norm = get_cmap_norm(levels, cmap, extend)
             kwargs.update({
             'norm': norm, 
             })
+    if levels is not None:
         if 'ticks' not in cbar_kwargs:
             cbar_kwargs.update({
                 'ticks': levels,
             })
     
-    _, _, nx, ny = np.array(ax.bbox.bounds, dtype=int)
     xlims = ax.get_xlim()
     ylims = ax.get_ylim()
 
-    im = egh.healpix_resample(
-        data, 
-        xlims, ylims, 
-        nx, ny, 
-        ax.projection, 
-        method='nearest', 
-        nest=True,
-    )
+    if resampled is None:
+        im = healpix_resample_nearest(data, ax)
+    else:
+        im = resampled
    
     map_ = ax.imshow(
         im, 
@@ -317,6 +444,201 @@ def default_plot(
     return fig, ax, map_
 
 
+def plot_panels(panels, axes, max_workers=None):
+    """Plot several healpix fields into existing axes, resampling all panels concurrently.
+
+    The resampling runs in a thread pool (the coordinate transformation and the
+    gather release the GIL) and axes with the same projection, extent and size
+    share one index map. Drawing happens sequentially afterwards.
+
+    Parameters
+    ----------
+    panels : list of tuple (data, dict)
+        Data to plot and keyword arguments passed on to `default_plot` for each panel.
+    axes : list of cartopy.mpl.geoaxes.GeoAxes
+        One axes per panel. The extent needs to be set already (e.g., `ax.set_global()`).
+    max_workers : int, optional, by default None
+        Passed on to `concurrent.futures.ThreadPoolExecutor`
+
+    Returns
+    -------
+    list of tuple (fig, ax, map_), one per panel
+    """
+    axes = list(axes)
+    if len(panels) != len(axes):
+        raise ValueError(f'Need one axes per panel: {len(panels)=}, {len(axes)=}')
+
+    datas = [np.asarray(data) for data, _ in panels]
+    geometries = [_axes_geometry(ax, data.size) for data, ax in zip(datas, axes)]
+
+    with ThreadPoolExecutor(max_workers) as pool:
+        # fill the index cache first so identical geometries are only computed once
+        list(pool.map(lambda geometry: _resample_index(*geometry), set(geometries)))
+        images = list(pool.map(healpix_resample_nearest, datas, axes))
+
+    return [
+        default_plot(data, ax=ax, resampled=im, **kwargs)
+        for (data, kwargs), ax, im in zip(panels, axes, images)
+    ]
+
+
+@lru_cache(maxsize=8)
+def _raster_geometry(projection, nx):
+    """Image height and extent of a global map of `projection` with `nx` pixels width."""
+    xlims = tuple(projection.x_limits)
+    ylims = tuple(projection.y_limits)
+    ny = int(round(nx * (ylims[1] - ylims[0]) / (xlims[1] - xlims[0])))
+    return ny, xlims, ylims
+
+
+@lru_cache(maxsize=8)
+def _coastline_layer(projection, nx, coastline_kwargs):
+    """Pre-rendered coastlines as RGBA image (transparent background, top row first)."""
+    ny, xlims, ylims = _raster_geometry(projection, nx)
+    fig = mpl.figure.Figure(figsize=(nx / 100, ny / 100), dpi=100)
+    fig.patch.set_alpha(0)
+    ax = fig.add_axes([0, 0, 1, 1], projection=projection)
+    ax.set_xlim(xlims)
+    ax.set_ylim(ylims)
+    ax.set_axis_off()
+    ax.patch.set_alpha(0)
+    defaults = {'color': 'k', 'lw': .1}
+    defaults.update(coastline_kwargs)
+    ax.coastlines(**defaults)
+    canvas = FigureCanvasAgg(fig)
+    canvas.draw()
+    layer = np.asarray(canvas.buffer_rgba())[:ny, :nx].copy()
+    layer.setflags(write=False)
+    return layer
+
+
+@lru_cache(maxsize=32)
+def _colorbar_layer(levels, colors, extend, nx, height):
+    """Pre-rendered horizontal colorbar as RGBA image (white background)."""
+    cmap, norm = _cmap_norm(levels, colors, extend)
+    fig = mpl.figure.Figure(figsize=(nx / 100, height / 100), dpi=100)
+    fig.patch.set_facecolor('white')
+    cax = fig.add_axes([.1, .55, .8, .3])
+    fig.colorbar(
+        mpl.cm.ScalarMappable(norm=norm, cmap=cmap), cax=cax,
+        orientation='horizontal', extend=extend, ticks=levels)
+    canvas = FigureCanvasAgg(fig)
+    canvas.draw()
+    layer = np.asarray(canvas.buffer_rgba())[:height, :nx].copy()
+    layer.setflags(write=False)
+    return layer
+
+
+def _composite(base, layer):
+    """Alpha-blend an RGBA `layer` onto an opaque RGBA `base` (both uint8) in place."""
+    alpha = layer[..., 3:].astype(np.uint16)
+    base[..., :3] = (layer[..., :3] * alpha + base[..., :3] * (255 - alpha) + 127) // 255
+    return base
+
+
+def write_png(fn, rgba, compress_level=1):
+    """Write an RGBA uint8 image of shape (ny, nx, 4), top row first, as PNG."""
+    rgba = np.ascontiguousarray(rgba, dtype=np.uint8)
+    ny, nx, _ = rgba.shape
+    # filter type 0 (none) at the start of each row
+    raw = np.concatenate([np.zeros((ny, 1), dtype=np.uint8), rgba.reshape(ny, -1)], axis=1)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+    with open(fn, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', nx, ny, 8, 6, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(raw.tobytes(), compress_level)))
+        f.write(chunk(b'IEND', b''))
+
+
+def render_raster(
+    data,
+    fn=None,
+    levels=None,
+    cmap='viridis',
+    extend='neither',
+    projection=None,
+    width=2000,
+    add_coastlines=True,
+    add_colorbar=True,
+    coastline_kwargs=None,
+    colorbar_height=None,
+    compress_level=1,
+):
+    """Render a global map of healpix data to a PNG without building a matplotlib figure.
+
+    Fast path for bulk map generation: the data are resampled with the cached index
+    map (see `healpix_resample_nearest`), mapped to colors with a lookup table and
+    combined with coastline and colorbar layers which are rendered by matplotlib only
+    once per projection/levels and then cached.
+
+    Parameters
+    ----------
+    data : np.ndarray, shape (N,)
+        Needs to be on a nested healpix grid
+    fn : string, optional, by default None
+        Path of the PNG file. If None, only the image is returned.
+    levels : list
+        Bounds of the color levels
+    cmap : string or list of colors, optional, by default 'viridis'
+        See `get_cmap_norm`
+    extend : string, optional, one of {'neither', 'min', 'max', 'both'}, by default 'neither'
+    projection : cartopy.ccrs, optional, by default ccrs.Mollweide()
+    width : int, optional, by default 2000
+        Width of the map in pixels. The height follows from the projection.
+    add_coastlines : bool, optional, by default True
+    add_colorbar : bool, optional, by default True
+    coastline_kwargs : dict, optional
+        Keyword arguments passed on to `ax.coastlines`
+    colorbar_height : int, optional, by default width // 10
+        Height of the colorbar in pixels.
+    compress_level : int, optional, by default 1
+        zlib compression level of the PNG (0-9).
+
+    Returns
+    -------
+    np.ndarray of uint8, shape (ny, nx, 4)
+        The RGBA image, top row first.
+    """
+    if levels is None:
+        raise ValueError('`levels` are required for raster output')
+    if projection is None:
+        projection = ccrs.Mollweide()
+    if coastline_kwargs is None:
+        coastline_kwargs = {}
+    if colorbar_height is None:
+        colorbar_height = width // 10
+
+    levels = _hashable(levels)
+    cmap, norm = get_cmap_norm(levels, cmap, extend)
+    data = np.asarray(data)
+    ny, xlims, ylims = _raster_geometry(projection, width)
+    valid, pix = _resample_index(hp.npix2nside(data.size), xlims, ylims, width, ny, projection)
+
+    # color index as in BoundaryNorm: 0 under, 1..n levels, n + 1 over
+    lut = cmap(np.arange(-1, len(levels)), bytes=True)
+    lut = np.concatenate([lut, [[255, 255, 255, 255]]])  # NaN
+    values = data[pix]
+    idx = np.digitize(values, levels)
+    idx[np.isnan(values)] = lut.shape[0] - 1
+
+    image = np.full(valid.shape + (4,), 255, dtype=np.uint8)
+    image[valid] = lut[idx]
+    image = image[::-1]  # first row at the top
+
+    if add_coastlines:
+        _composite(image, _coastline_layer(projection, width, _hashable(tuple(sorted(coastline_kwargs.items())))))
+    if add_colorbar:
+        colors = _hashable(_colormap_colors(cmap, extend))
+        image = np.concatenate([image, _colorbar_layer(levels, colors, extend, width, colorbar_height)])
+
+    if fn is not None:
+        write_png(fn, image, compress_level)
+    return image
+
+
 def plot_polygon(ax, corners, closed=True, **kwargs):
     """
     Plot a user-defined polygon on the map.
@@ -0,0 +1,157 @@
+"""Opt-in instrumentation of the loaders and kernels.
+
+Disabled by default: instrumented functions then only check one flag. Enable it for a run
+with `instrument.enable()` or by setting the environment variable HEALPIX_INSTRUMENT=1.
+
+The memory peak is only reliable for stages that do not overlap with stages in other
+threads (e.g., dask workers); for overlapping stages it is recorded as None (see `stage`).
+
+Examples
+--------
+>>> import instrument
+>>> instrument.enable()
+>>> cases = utils.get_cases('txx')
+>>> instrument.report('get_cases_txx.json')
+"""
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+
+enabled = os.environ.get('HEALPIX_INSTRUMENT', '0') not in ('', '0')
+records = []
+
+_trace_memory = True
+_lock = threading.Lock()
+_local = threading.local()
+_active = []  # frames of the active stages of all threads
+
+
+def enable(trace_memory=True):
+    """Start recording. `trace_memory` also records the tracemalloc peak (slower)."""
+    global enabled, _trace_memory
+    enabled = True
+    _trace_memory = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    global enabled
+    enabled = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def reset():
+    """Remove all records."""
+    with _lock:
+        records.clear()
+
+
+def _describe(value):
+    """Shape, dtype and size of array-like values (numpy, dask, xarray), None otherwise."""
+    shape = getattr(value, 'shape', None)
+    dtype = getattr(value, 'dtype', None)
+    if shape is None or dtype is None:
+        return None
+    return {'shape': list(shape), 'dtype': str(dtype), 'nbytes': int(getattr(value, 'nbytes', 0))}
+
+
+@contextmanager
+def stage(name, **info):
+    """Record wall time and memory peak of a block of code as one stage.
+
+    Additional keyword arguments (e.g., bytes read) are stored with the record and can
+    be updated within the block via the yielded dict.
+
+    Stages are nested per thread: stages in other threads (e.g., kernels run by dask
+    workers) are recorded with depth 0. The tracemalloc peak is process-wide, so it is
+    only recorded for stages during which no stage was active in another thread;
+    otherwise `peak_memory` is None.
+    """
+    if not enabled:
+        yield info
+        return
+
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    thread = threading.get_ident()
+    record = {'stage': name, 'start': time.time(), 'depth': len(stack), 'thread': thread, **info}
+    tracing = _trace_memory and tracemalloc.is_tracing()
+    # memory in use at the start, absolute peak of nested stages, overlaps with other threads
+    frame = {'record': record, 'thread': thread, 'memory': 0, 'peak': 0, 'overlap': False}
+    with _lock:
+        for other in _active:
+            if other['thread'] != thread:
+                other['overlap'] = frame['overlap'] = True
+        _active.append(frame)
+        if tracing and not frame['overlap']:
+            frame['memory'] = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+    stack.append(frame)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['wall_time'] = time.perf_counter() - start
+        stack.pop()
+        with _lock:
+            _active.remove(frame)
+            if tracing and frame['overlap']:
+                record['peak_memory'] = None
+            elif tracing:
+                # nested stages reset the peak, so they pass theirs on to the enclosing stage
+                peak = max(tracemalloc.get_traced_memory()[1], frame['peak'])
+                record['peak_memory'] = peak - frame['memory']
+                if stack:
+                    stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            records.append(record)
+
+
+def instrumented(func):
+    """Decorator recording each call of `func` as a stage with its argument and output arrays."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return func(*args, **kwargs)
+        inputs = [desc for desc in map(_describe, list(args) + list(kwargs.values())) if desc is not None]
+        with stage(func.__qualname__, inputs=inputs) as record:
+            result = func(*args, **kwargs)
+            record['output'] = _describe(result)
+        return result
+    return wrapper
+
+
+def report(fn=None):
+    """Return all records and optionally write them to `fn` (.json or .csv).
+
+    In the CSV file nested values (e.g., shapes of the inputs) are stored as JSON strings.
+    """
+    with _lock:
+        result = sorted(records, key=lambda record: record['start'])
+    if fn is None:
+        return result
+
+    import json
+
+    if fn.endswith('.csv'):
+        import csv
+
+        fields = []
+        for record in result:
+            fields += [key for key in record if key not in fields]
+        with open(fn, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            for record in result:
+                writer.writerow({
+                    key: json.dumps(value) if isinstance(value, (list, dict)) else value
+                    for key, value in record.items()})
+    else:
+        with open(fn, 'w') as f:
+            json.dump(result, f, indent=1)
+    return result
@@ -0,0 +1,238 @@
+import numpy as np
+import xarray as xr
+import healpy as hp
+
+from healpix_functions import aggregate_grid
+
+
+def _region_mask(definition, zoom: int, lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+    """Boolean mask of the cells (centers) belonging to a region definition."""
+    npix = lon.size
+    definition = np.asarray(definition)
+
+    if definition.dtype == bool:  # land/sea or other masks
+        if definition.size == npix:
+            return definition
+        if definition.size > npix:  # finer mask: majority of the sub-grid cells
+            return aggregate_grid(definition.astype(np.float32), zoom, 'mean') > .5
+        ratio = npix // definition.size
+        return np.repeat(definition, ratio)
+
+    if definition.ndim != 2 or definition.shape[1] != 2 or len(definition) < 3:
+        raise ValueError('Region needs to be a boolean mask or a list of (lon, lat) corners')
+
+    # continuous longitudes starting at the westernmost corner (allows negative longitudes)
+    lon_min = definition[:, 0].min()
+    lon = (lon - lon_min) % 360 + lon_min
+
+    if len(definition) == 4 and len(np.unique(definition[:, 0])) == 2 and len(np.unique(definition[:, 1])) == 2:
+        # box: same as `healpix_functions.get_indices_in_rectangle`
+        lon1, lat1 = definition.min(axis=0)
+        lon2, lat2 = definition.max(axis=0)
+        return (lon >= lon1) & (lon <= lon2) & (lat >= lat1) & (lat <= lat2)
+
+    from matplotlib.path import Path
+    return Path(definition).contains_points(np.stack([lon, lat], axis=-1))
+
+
+class RegionSummary:
+    """Grouped regional statistics of healpix fields.
+
+    The cell -> region membership is computed once per zoom level and stored as pairs of
+    (cell, region) indices, so overlapping regions (e.g., 'global' and 'land') are possible.
+    All statistics of all regions are then computed in one pass with `np.bincount`.
+    Statistics are area-weighted: healpix cells have equal area, so only the optional
+    `weights` (e.g., land fraction) enter. NaNs are ignored.
+
+    Parameters
+    ----------
+    regions : dict {name: definition}
+        Each definition is one of
+        - list of four (lon, lat) corners of a box (same as `get_indices_in_rectangle`)
+        - list of (lon, lat) corners of a polygon (cell centers inside the polygon)
+        - boolean mask on a healpix grid, e.g., land/sea mask. Masks on a different zoom
+          level are regridded (majority of the sub-grid cells for finer masks).
+        - None: global
+    zoom : int
+    weights : np.ndarray, shape (M,), optional, by default None
+        Additional weights per cell.
+
+    Examples
+    --------
+    >>> summary = RegionSummary({'global': None, 'south_asia': [(60, 5), (95, 5), (95, 30), (60, 30)]}, zoom=9)
+    >>> summary.mean(txx_anom)
+    """
+    def __init__(self, regions: dict, zoom: int, weights=None):
+        self.names = list(regions)
+        self.zoom = zoom
+        self.npix = hp.nside2npix(2**zoom)
+
+        lon, lat = hp.pix2ang(2**zoom, np.arange(self.npix), nest=True, lonlat=True)
+        cells, labels = [], []
+        for label, definition in enumerate(regions.values()):
+            if definition is None:
+                idx = np.arange(self.npix)
+            else:
+                idx = np.where(_region_mask(definition, zoom, lon, lat))[0]
+            cells.append(idx)
+            labels.append(np.full(idx.size, label))
+        self.cells = np.concatenate(cells)
+        self.labels = np.concatenate(labels)
+        self.weights = None if weights is None else np.asarray(weights, dtype=np.float64)[self.cells]
+
+    def __repr__(self):
+        return f'{type(self).__name__}(zoom={self.zoom}, regions={self.names})'
+
+    @property
+    def nregions(self):
+        return len(self.names)
+
+    def _gather(self, arr):
+        """Values of all (cell, region) pairs, shape (L, K) with L leading elements flattened."""
+        arr = np.asarray(arr)
+        if arr.shape[-1] != self.npix:
+            raise ValueError(f'Expected {self.npix} cells (zoom {self.zoom}) not {arr.shape[-1]}')
+        return arr.reshape(-1, self.npix)[:, self.cells], arr.shape[:-1]
+
+    def _grouped_sum(self, values):
+        """Sum over (cell, region) pairs per region for each row of values (L, K) -> (L, R)."""
+        nrows = values.shape[0]
+        groups = (np.arange(nrows)[:, None] * self.nregions + self.labels).ravel()
+        sums = np.bincount(groups, weights=values.ravel(), minlength=nrows * self.nregions)
+        return sums.reshape(nrows, self.nregions)
+
+    def _moments(self, arr):
+        values, shape = self._gather(arr)
+        valid = np.isfinite(values)
+        weights = valid if self.weights is None else valid * self.weights
+        values = np.where(valid, values, 0)
+        wsum = self._grouped_sum(weights)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self._grouped_sum(weights * values) / wsum
+        return values, weights, wsum, mean, shape
+
+    def count(self, arr) -> np.ndarray:
+        """Number of valid cells per region, shape (..., R)."""
+        values, shape = self._gather(arr)
+        return self._grouped_sum(np.isfinite(values)).astype(int).reshape(shape + (self.nregions,))
+
+    def mean(self, arr) -> np.ndarray:
+        """Area-weighted mean per region, shape (..., R)."""
+        _, _, _, mean, shape = self._moments(arr)
+        return mean.reshape(shape + (self.nregions,))
+
+    def std(self, arr) -> np.ndarray:
+        """Area-weighted standard deviation per region, shape (..., R)."""
+        values, weights, wsum, mean, shape = self._moments(arr)
+        # two-pass: deviations from the regional mean
+        dev = values - np.take_along_axis(mean, np.broadcast_to(self.labels, values.shape), axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            var = self._grouped_sum(weights * dev**2) / wsum
+        return np.sqrt(var).reshape(shape + (self.nregions,))
+
+    def quantile(self, arr, q) -> np.ndarray:
+        """Quantiles per region (linear interpolation, unweighted), shape (..., R, Q)."""
+        q = np.atleast_1d(q)
+        values, shape = self._gather(arr)
+        result = np.full((values.shape[0], self.nregions, q.size), np.nan)
+        for vals, res in zip(values, result):
+            valid = np.isfinite(vals)
+            vals, labels = vals[valid], self.labels[valid]
+            # sort by region first and value second: each region is a contiguous sorted block
+            order = np.lexsort((vals, labels))
+            vals = vals[order]
+            counts = np.bincount(labels, minlength=self.nregions)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            has_data = counts > 0
+
+            pos = starts[has_data, None] + q * (counts[has_data, None] - 1)
+            lower = np.floor(pos).astype(int)
+            upper = np.minimum(lower + 1, (starts + counts)[has_data, None] - 1)
+            frac = pos - lower
+            res[has_data] = vals[lower] * (1 - frac) + vals[upper] * frac
+        return result.reshape(shape + (self.nregions, q.size))
+
+    def histogram(self, arr, bins) -> np.ndarray:
+        """Histogram counts per region (same bin convention as `np.histogram`), shape (..., R, B)."""
+        bins = np.asarray(bins)
+        nbins = bins.size - 1
+        values, shape = self._gather(arr)
+        idx = np.searchsorted(bins, values, side='right') - 1
+        idx[values == bins[-1]] = nbins - 1  # last bin is closed
+        valid = (idx >= 0) & (idx < nbins)
+
+        nrows = values.shape[0]
+        groups = (np.arange(nrows)[:, None] * self.nregions + self.labels) * nbins + idx
+        weights = valid if self.weights is None else valid * self.weights
+        counts = np.bincount(groups[valid], weights=weights[valid], minlength=nrows * self.nregions * nbins)
+        return counts.reshape(shape + (self.nregions, nbins))
+
+    def summarize(self, arr, quantiles=(.05, .5, .95), bins=None) -> xr.Dataset:
+        """All regional statistics of a field in one xr.Dataset with a `region` dimension.
+
+        Parameters
+        ----------
+        arr : np.ndarray or xr.DataArray, shape (M,)
+        quantiles : list of float, optional
+        bins : np.ndarray, optional, by default None
+            If given, also compute histograms.
+
+        Returns
+        -------
+        xr.Dataset
+        """
+        arr = np.asarray(arr)
+        if arr.ndim != 1:
+            raise ValueError('Only fields with shape (M,) are supported, reduce other dimensions first')
+        ds = xr.Dataset(
+            {
+                'mean': ('region', self.mean(arr)),
+                'std': ('region', self.std(arr)),
+                'count': ('region', self.count(arr)),
+                'quantile': (('region', 'q'), self.quantile(arr, quantiles)),
+            },
+            coords={'region': self.names, 'q': list(quantiles)},
+        )
+        if bins is not None:
+            bins = np.asarray(bins)
+            ds['histogram'] = (('region', 'bin'), self.histogram(arr, bins))
+            ds = ds.assign_coords(bin=(bins[1:] + bins[:-1]) / 2)
+        return ds
+
+
+def summarize_cases(cases: dict, regions: dict, quantiles=(.05, .5, .95), bins=None) -> xr.Dataset:
+    """Regional statistics for all fields returned by `utils.calc_cases`.
+
+    The cell -> region membership is computed once per zoom level.
+
+    Parameters
+    ----------
+    cases : xr.Dataset with a `model` dimension or dict {model: {case: xr.DataArray}}
+    regions : dict
+        See `RegionSummary`
+    quantiles : list of float, optional
+    bins : np.ndarray, optional, by default None
+
+    Returns
+    -------
+    xr.Dataset with dimensions (model, case, region, ...)
+    """
+    if isinstance(cases, xr.Dataset):
+        cases = {
+            model: {case: cases[case].sel(model=model) for case in cases.data_vars}
+            for model in cases['model'].values}
+
+    summaries = {}
+    results = {}
+    for model, model_cases in cases.items():
+        results[model] = {}
+        for case, da in model_cases.items():
+            zoom = int(np.log2(hp.npix2nside(da.size)))
+            if zoom not in summaries:
+                summaries[zoom] = RegionSummary(regions, zoom)
+            results[model][case] = summaries[zoom].summarize(da, quantiles=quantiles, bins=bins)
+
+    return xr.concat([
+        xr.concat(list(model_results.values()), dim=xr.Variable('case', list(model_results)))
+        for model_results in results.values()
+    ], dim=xr.Variable('model', list(results)))
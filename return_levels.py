@@ -0,0 +1,153 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.special import gamma
+
+
+def lmoments(maxima: np.ndarray):
+    """Sample L-moments of annual maxima along the first axis (unbiased estimators).
+
+    Parameters
+    ----------
+    maxima : np.ndarray, shape (Y, M)
+        Annual maxima of Y years for M cells. Cells containing NaN return NaN.
+
+    Returns
+    -------
+    l1, l2, t3 : np.ndarray, shape (M,)
+        Mean, L-scale and L-skewness.
+    """
+    x = np.sort(np.asarray(maxima, dtype=np.float64), axis=0)
+    n = x.shape[0]
+    if n < 3:
+        raise ValueError(f'At least 3 years are needed, got {n}')
+    j = np.arange(n, dtype=np.float64).reshape((n,) + (1,) * (x.ndim - 1))
+    b0 = x.mean(axis=0)
+    b1 = (j / (n - 1) * x).mean(axis=0)
+    b2 = (j * (j - 1) / ((n - 1) * (n - 2)) * x).mean(axis=0)
+    l2 = 2 * b1 - b0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t3 = (6 * b2 - 6 * b1 + b0) / l2
+    return b0, l2, t3
+
+
+def fit_gev(maxima: np.ndarray, shape_bounds=(-.5, .5)):
+    """Fit a GEV distribution to annual maxima of each cell by L-moments.
+
+    Uses the approximation of Hosking et al. (1985) for the shape parameter, which
+    is accurate for -0.5 < shape < 0.5. The shape follows the sign convention of
+    Hosking and `scipy.stats.genextreme` (shape < 0: heavy upper tail).
+
+    Parameters
+    ----------
+    maxima : np.ndarray, shape (Y, M)
+    shape_bounds : tuple of float, optional, by default (-.5, .5)
+        Constrain the shape parameter to this range (None: no constraint).
+
+    Returns
+    -------
+    loc, scale, shape : np.ndarray, shape (M,)
+    """
+    l1, l2, t3 = lmoments(maxima)
+    z = 2 / (3 + t3) - np.log(2) / np.log(3)
+    shape = 7.8590 * z + 2.9554 * z**2
+    if shape_bounds is not None:
+        shape = np.clip(shape, *shape_bounds)
+
+    gumbel = np.abs(shape) < 1e-6
+    k = np.where(gumbel, 1, shape)  # avoid division by zero, replaced below
+    g = gamma(1 + k)
+    scale = np.where(gumbel, l2 / np.log(2), l2 * k / ((1 - 2**-k) * g))
+    loc = np.where(gumbel, l1 - np.euler_gamma * scale, l1 - scale * (1 - g) / k)
+    return loc, scale, shape
+
+
+def gev_return_level(loc, scale, shape, return_period):
+    """Return level exceeded on average once every `return_period` years."""
+    y = -np.log(1 - 1 / np.asarray(return_period, dtype=np.float64))
+    gumbel = np.abs(shape) < 1e-6
+    k = np.where(gumbel, 1, shape)
+    return np.where(gumbel, loc - scale * np.log(y), loc + scale / k * (1 - y**k))
+
+
+def _return_levels_block(maxima, out, start, stop, return_periods, shape_bounds):
+    """Fit cells [start, stop) and write their return levels into `out`.
+
+    `maxima` and `out` are either arrays or paths to .npy files which are opened as memory
+    maps, so that blocks can be processed in separate processes without copying the data.
+    """
+    if isinstance(maxima, str):
+        maxima = np.load(maxima, mmap_mode='r')
+    if isinstance(out, str):
+        out = np.load(out, mmap_mode='r+')
+
+    loc, scale, shape = fit_gev(maxima[:, start:stop], shape_bounds)
+    levels = gev_return_level(loc, scale, shape, np.reshape(return_periods, (-1, 1)))
+    out[..., start:stop] = levels.reshape(out.shape[:-1] + (-1,))
+    if isinstance(out, np.memmap):
+        out.flush()
+
+
+def return_levels(maxima, return_periods=10, out=None, block_size=2**16, max_workers=None, shape_bounds=(-.5, .5), dtype=np.float32):
+    """GEV return levels for each cell from annual maxima, processed in blocks of cells.
+
+    Only one block of cells is held in memory at a time, so fields with millions of
+    cells (e.g., zoom 9 and above) can be processed directly from and to disk.
+
+    Parameters
+    ----------
+    maxima : np.ndarray or string, shape (Y, M)
+        Annual maxima or path to a .npy file containing them (opened as memory map).
+    return_periods : float or list of float, optional, by default 10
+        Return periods in years.
+    out : string, optional, by default None
+        Path of the .npy file to write the return levels to (same format as `np.save`,
+        can be read with `np.load`). By default an in-memory array is returned.
+    block_size : int, optional, by default 2**16
+        Number of cells fitted at once.
+    max_workers : int, optional, by default None
+        Number of processes. Only used if both `maxima` and `out` are paths, otherwise
+        all blocks are processed in the current process.
+    shape_bounds : tuple of float, optional, by default (-.5, .5)
+        See `fit_gev`.
+    dtype : np.dtype, optional, by default np.float32
+
+    Returns
+    -------
+    np.ndarray, shape (M,) or (R, M) if `return_periods` is a list
+        Memory map of `out` if given.
+
+    Examples
+    --------
+    >>> rl10 = return_levels('rx1h_icon_z9.npy', 10, out='rl10_1h_icon_z9.npy', max_workers=8)
+    """
+    scalar = np.ndim(return_periods) == 0
+    return_periods = np.atleast_1d(return_periods)
+    if isinstance(maxima, str):
+        shape = np.load(maxima, mmap_mode='r').shape
+    else:
+        maxima = np.asarray(maxima)
+        shape = maxima.shape
+    npix = shape[-1]
+    shape_out = (npix,) if scalar else (return_periods.size, npix)
+
+    if out is None:
+        result = np.full(shape_out, np.nan, dtype=dtype)
+    else:
+        result = np.lib.format.open_memmap(out, mode='w+', dtype=dtype, shape=shape_out)
+
+    blocks = [(start, min(start + block_size, npix)) for start in range(0, npix, block_size)]
+    if isinstance(maxima, str) and out is not None and max_workers != 1:
+        result.flush()
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+            futures = [
+                executor.submit(_return_levels_block, maxima, out, start, stop, return_periods, shape_bounds)
+                for start, stop in blocks]
+            for future in futures:
+                future.result()  # raise errors from the workers
+        result = np.load(out, mmap_mode='r+')
+    else:
+        for start, stop in blocks:
+            _return_levels_block(maxima, result, start, stop, return_periods, shape_bounds)
+    return result
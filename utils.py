@@ -1,81 +1,164 @@
-import os
-import xarray as xr
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-import cartopy.crs as ccrs
-
-from healpix_functions import aggregate_grid_xarray, sub_grid_anomaly_xarray, evaluate_against_coarse_xarray, _guess_gridn
-from etccdi_dict import etccdi_indices
+from healpix_functions import aggregate_grid_xarray, sub_grid_anomaly_xarray, evaluate_against_coarse_xarray, get_block_ranges, _guess_gridn
+from etccdi_dict import etccdi_indices, etccdi_registry
+from data_catalog import IndexCatalog
+from etccdi_compute import compute_indices
+from instrument import stage
 
 
 dpi = 2000
-mpl.rc('font', **{'size': 6})
-proj = ccrs.Mollweide()
-proj._threshold /= 10000.
 cm = 1/2.54  # centimeters in inches
 
 path = 'data'
 figpath = '../figures_etccdi'
+catalog = IndexCatalog(path)
+
+_proj = None
+
+
+def _get_proj():
+    """Set up matplotlib and the map projection on first use (keeps importing this module fast)."""
+    global _proj
+    if _proj is None:
+        import matplotlib as mpl
+        import cartopy.crs as ccrs
+
+        mpl.rc('font', **{'size': 6})
+        _proj = ccrs.Mollweide()
+        _proj._threshold /= 10000.
+    return _proj
+
+
+def __getattr__(name):
+    if name == 'proj':
+        return _get_proj()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def get_ax():
+    import matplotlib.pyplot as plt
+
+    proj = _get_proj()
     fig, ax = plt.subplots(figsize=(8*cm, 4*cm), dpi=dpi, subplot_kw={'projection': proj})
     fig.subplots_adjust(left=.01, bottom=.01)
     ax.set_global()
     return fig, ax
 
 
-def calc_cases(icon_z9, icon_z6, ifs_z9, ifs_z6):
-    cases = {
-        'icon': {
-            'z9': icon_z9.mean('time'),
-            'z6': icon_z6.mean('time'),
-            # 'z9_mean_z6': aggregate_grid_xarray(icon_z9, z_out=6, method='mean').mean('time'),
-            # sub-grid cases: index calculation first
-            'z9_std_z6': aggregate_grid_xarray(icon_z9, z_out=6, method='std').mean('time'),
-            'z9_cv_z6': aggregate_grid_xarray(icon_z9, z_out=6, method='cv').mean('time'),
-            'z9_anom_z9': sub_grid_anomaly_xarray(icon_z9, z_coarse=6).mean('time'),   
-            # sub-grid cases: regridding first
-            'z9-z6_anom_z9': evaluate_against_coarse_xarray(icon_z9, icon_z6).mean('time'),
-        },
-        'ifs': {
-            'z9': ifs_z9.mean('time'),
-            'z6': ifs_z6.mean('time'),
-            # 'z9_mean_z6': aggregate_grid_xarray(ifs_z9, z_out=6, method='mean').mean('time'),
-            # sub-grid cases: index calculation first
-            'z9_std_z6': aggregate_grid_xarray(ifs_z9, z_out=6, method='std').mean('time'),
-            'z9_cv_z6': aggregate_grid_xarray(ifs_z9, z_out=6, method='cv').mean('time'),
-            'z9_anom_z9': sub_grid_anomaly_xarray(ifs_z9, z_coarse=6).mean('time'),   
-            # sub-grid cases: regridding first
-            'z9-z6_anom_z9': evaluate_against_coarse_xarray(ifs_z9, ifs_z6).mean('time'),
-        },
-    }
-
-    return cases
-
-
-def get_cases(index):
-    fn_icon_z9 = os.path.join(path, 'ICON-ngc4008', 'z9', f'{index}_ann_ICON-ngc4008_ssp370_zoom9.nc')
-    fn_icon_z6 = os.path.join(path, 'ICON-ngc4008', 'z6', f'{index}_ann_ICON-ngc4008_ssp370_zoom6.nc')
-    fn_ifs_z9 = os.path.join(path, 'IFS-9-FESOM-5-production', 'z9', f'{index}_ann_IFS-9-FESOM-5-production_ssp370_zoom9.nc')
-    fn_ifs_z6 = os.path.join(path, 'IFS-9-FESOM-5-production', 'z6', f'{index}_ann_IFS-9-FESOM-5-production_ssp370_zoom6.nc')
-
-    icon_z9 = xr.open_dataset(fn_icon_z9, decode_timedelta=False)[index].load()
-    icon_z6 = xr.open_dataset(fn_icon_z6, decode_timedelta=False)[index].load()
-    if index in ['tasmin', 'tasmax', 'pr']:  # base variables are daily
-        icon_z9 = icon_z9.resample(time='1Y').mean()
-        icon_z6 = icon_z6.resample(time='1Y').mean()
-    
-    ifs_z9 = xr.open_dataset(fn_ifs_z9, decode_timedelta=False)[index].load()
-    ifs_z6 = xr.open_dataset(fn_ifs_z6, decode_timedelta=False)[index].load()
-    if index in ['tasmin', 'tasmax', 'pr']:
-        ifs_z9 = ifs_z9.resample(time='1Y').mean()
-        ifs_z6 = ifs_z6.resample(time='1Y').mean()
-
-    # keeping these breaks xarrays apply_ufunc
-    icon_z9 = icon_z9.drop(['lon', 'lat', 'crs'])
-    icon_z6 = icon_z6.drop(['lon', 'lat', 'crs'])
-    ifs_z9 = ifs_z9.drop(['lon', 'lat', 'crs'])
-    ifs_z6 = ifs_z6.drop(['lon', 'lat', 'crs'])
-
-    return calc_cases(icon_z9, icon_z6, ifs_z9, ifs_z6)
\ No newline at end of file
+def stack_models(data: dict):
+    """Stack DataArrays of several models along a new `model` dimension.
+
+    Time is aligned by year, so models with different time stamps (e.g., calendars)
+    within the same year are combined. Years missing in a model are filled with NaN.
+
+    Parameters
+    ----------
+    data : dict {model: xr.DataArray}
+
+    Returns
+    -------
+    xr.DataArray
+    """
+    import xarray as xr
+
+    return xr.concat(
+        [da.assign_coords(time=da['time'].dt.year.values) for da in data.values()],
+        dim=xr.Variable('model', list(data)),
+        join='outer',
+    )
+
+
+def calc_cases(da_z9, da_z6, gridn=None):
+    """Time mean and sub-grid cases of an index for all models at once.
+
+    Each case is one (batched) call of the corresponding kernel for all models. For
+    dask-backed input chunked along `model` the models are processed in parallel.
+
+    Parameters
+    ----------
+    da_z9, da_z6 : xr.DataArray, dims (model, time, cell)
+        See `stack_models`.
+    gridn : string, optional, by default None
+        Name of the grid dimension. Guessed if not given.
+
+    Returns
+    -------
+    xr.Dataset, one variable per case
+        Cases on zoom 6 have the grid dimension '{gridn}_z6'.
+    """
+    import xarray as xr
+
+    if gridn is None:  # try to guess grid name from frequent options
+        gridn = _guess_gridn(da_z9)
+    coarse = {gridn: f'{gridn}_z6'}
+
+    return xr.Dataset({
+        'z9': da_z9.mean('time'),
+        'z6': da_z6.mean('time').rename(coarse),
+        # 'z9_mean_z6': aggregate_grid_xarray(da_z9, z_out=6, method='mean').mean('time').rename(coarse),
+        # sub-grid cases: index calculation first
+        'z9_std_z6': aggregate_grid_xarray(da_z9, z_out=6, method='std', gridn=gridn).mean('time').rename(coarse),
+        'z9_cv_z6': aggregate_grid_xarray(da_z9, z_out=6, method='cv', gridn=gridn).mean('time').rename(coarse),
+        'z9_anom_z9': sub_grid_anomaly_xarray(da_z9, z_coarse=6, gridn=gridn).mean('time'),
+        # sub-grid cases: regridding first
+        'z9-z6_anom_z9': evaluate_against_coarse_xarray(da_z9, da_z6, gridn=gridn).mean('time'),
+    })
+
+
+def get_cases(index, models=('icon', 'ifs'), dtype=None):
+    """Load `index` at zoom 9 and 6 for all `models` and compute all cases (see `calc_cases`)."""
+    data = {9: {}, 6: {}}
+    for model in models:
+        for zoom in [9, 6]:
+            da = catalog.get(index, model, zoom, dtype=dtype)
+            daily = index in ['tasmin', 'tasmax', 'pr']
+            if daily:  # base variables are daily
+                da = da.resample(time='1Y').mean()
+            # reading, decoding and (for daily data) resampling happen here
+            with stage('load', index=index, model=model, zoom=zoom, resample=daily) as record:
+                data[zoom][model] = da.load()
+                record['nbytes'] = da.nbytes
+
+    # one chunk per model: the kernels run in parallel across models
+    da_z9 = stack_models(data[9]).chunk({'model': 1})
+    da_z6 = stack_models(data[6]).chunk({'model': 1})
+    with stage('calc_cases', index=index):
+        return calc_cases(da_z9, da_z6).compute()
+
+
+def get_cases_from_daily(index, models=('icon', 'ifs'), frequency='ann', block_size=None, **kwargs):
+    """Same as `get_cases` but compute the index from the daily base variable at zoom 9.
+
+    The daily data are read once per model, one block of cells at a time. In the same
+    pass they are aggregated to zoom 6 and the index is computed on both grids, so both
+    the 'index first' and the 'regridding first' cases are available without
+    precomputed zoom 6 files.
+
+    Parameters
+    ----------
+    index : string
+        Key of `etccdi_compute.index_specs`
+    models : list of string, optional, by default ('icon', 'ifs')
+    frequency : string, optional, by default 'ann'
+        Frequency part of the file names of the daily base variables (see `IndexCatalog`).
+        The default reads the same files as `get_cases`.
+    block_size : int, optional, by default None
+        Number of zoom 9 cells read at once. Defaults to one base pixel (see
+        `get_block_ranges`), i.e., ~380 MB per year of float32 data.
+    **kwargs : optional
+        Keyword arguments passed on to `etccdi_compute.compute_indices` (e.g., thresholds).
+    """
+    if block_size is None:
+        start, stop = get_block_ranges(9, block_zoom=0)[0]
+        block_size = stop - start
+    base_variable = etccdi_registry[index].base_variable[0]
+    data = {9: {}, 6: {}}
+    for model in models:
+        # lazily indexed: each block only reads its part of the file
+        daily = catalog.get(base_variable, model, 9, frequency=frequency, lazy=True)
+        ds = compute_indices(daily, [index], zooms=[9, 6], block_size=block_size, **kwargs)
+        data[9][model] = ds[9][index]
+        data[6][model] = ds[6][index]
+
+    da_z9 = stack_models(data[9]).chunk({'model': 1})
+    da_z6 = stack_models(data[6]).chunk({'model': 1})
+    return calc_cases(da_z9, da_z6).compute()